@@ -5,53 +5,153 @@ Provides a user-friendly command-line interface with color coding and clear form
 
 import os
 import sys
-import json
 from datetime import datetime
 from typing import Optional
 import argparse
 
-# Try to import colorama for colored output (optional)
-try:
-    from colorama import init, Fore, Back, Style
+from config import Config, DevelopmentConfig, ProductionConfig, get_config, json_dumps_bytes, json_loads
+
+_QUIT_COMMANDS = frozenset({"quit", "exit"})
+_YES_ANSWERS = frozenset({"yes", "y"})
+
+# Consultation history is an append-only JSON Lines log (one record per line)
+HISTORY_FILE = "consultation_history.jsonl"
+
+# Color constants are resolved lazily by _init_color(); these no-op stand-ins
+# keep the module importable (and --help fast) without touching colorama.
+HAS_COLOR = False
+
+
+class Fore:
+    RED = GREEN = YELLOW = BLUE = MAGENTA = CYAN = WHITE = RESET = ''
+
+
+class Back:
+    RED = GREEN = YELLOW = BLUE = MAGENTA = CYAN = WHITE = RESET = ''
+
+
+class Style:
+    BRIGHT = DIM = NORMAL = RESET_ALL = ''
+
+
+_color_initialized = False
+
+
+def _init_color():
+    """Import colorama on first use and swap in the real color constants"""
+    global Fore, Back, Style, HAS_COLOR, _color_initialized
+    if _color_initialized:
+        return
+    _color_initialized = True
+
+    # Try to import colorama for colored output (optional)
+    try:
+        from colorama import init, Fore as _Fore, Back as _Back, Style as _Style
+    except ImportError:
+        return
     init(autoreset=True)
+    Fore, Back, Style = _Fore, _Back, _Style
     HAS_COLOR = True
-except ImportError:
-    HAS_COLOR = False
-    # Define dummy color constants if colorama not available
-    class Fore:
-        RED = GREEN = YELLOW = BLUE = MAGENTA = CYAN = WHITE = RESET = ''
-    class Style:
-        BRIGHT = DIM = NORMAL = RESET_ALL = ''
 
-from medical_consultation_system import MedicalConsultationSystem
-from config import Config, DevelopmentConfig, ProductionConfig, get_config
+
+def _tail_records(path: str, n: int = 5, chunk: int = 4096) -> list:
+    """Return the last n JSON Lines records by reading backwards from the end of the file"""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b""
+        # Need more than n newlines to be sure the oldest kept line is complete
+        while pos > 0 and data.count(b"\n") <= n:
+            step = min(chunk, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    lines = data.split(b"\n")
+    lines.pop()  # text after the last newline is a partial (interrupted) append, or empty
+    if pos > 0:
+        lines = lines[1:]  # drop the partial first line
+    records = []
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            records.append(json_loads(line))
+        except ValueError:
+            # Corrupt line, e.g. an append that was interrupted mid-write
+            continue
+    return records[-n:]
+
+
+def _write(text: str):
+    """Emit a whole screen of output with a single write and flush"""
+    sys.stdout.write(text)
+    sys.stdout.flush()
 
 
 class ConsultationCLI:
     """Enhanced command-line interface for the medical consultation system"""
     
+    # Bound once so per-save timestamps skip the datetime attribute lookup
+    _now = staticmethod(datetime.now)
+    
     def __init__(self, api_key: str, environment: str = "development", model: Optional[str] = None):
         """Initialize the CLI with configuration"""
+        _init_color()
         self.config = get_config(environment)
         selected_model = model or self.config.MODEL_NAME
         if model and model not in Config.AVAILABLE_MODELS:
-            raise ValueError(f"Model '{model}' is not supported. Choose from: {', '.join(Config.AVAILABLE_MODELS)}")
+            raise ValueError(f"Model '{model}' is not supported. Choose from: {', '.join(sorted(Config.AVAILABLE_MODELS))}")
 
-        self.system = MedicalConsultationSystem(api_key, selected_model)
+        import asyncio
+        from medical_consultation_system import MedicalConsultationSystem, SemanticCache
+        # The agents are coroutines; a single loop for the whole session keeps
+        # the client's pooled HTTP session bound to one loop across calls
+        self._loop = asyncio.new_event_loop()
+        cache = None
+        if self.config.SEMANTIC_CACHE_ENABLED:
+            try:
+                cache = SemanticCache(
+                    threshold=self.config.SEMANTIC_CACHE_THRESHOLD,
+                    ttl_seconds=self.config.SEMANTIC_CACHE_TTL_SECONDS,
+                    max_entries=self.config.SEMANTIC_CACHE_MAX_ENTRIES,
+                )
+            except RuntimeError:
+                # numpy not installed; consultations simply run uncached
+                cache = None
+        self.system = MedicalConsultationSystem(api_key, selected_model, cache=cache)
         self.model_name = selected_model
-        self.session_start = datetime.now()
+        self.session_start = self._now()
         self.consultation_count = 0
+        self._BANNERS = self._build_banners()
+        self._FINAL_BANNERS = self._build_final_banners()
+        self._history_fp = None
         
-    def print_header(self):
-        """Print application header"""
-        print("\n" + "=" * 70)
-        print(f"{Style.BRIGHT}{Fore.CYAN}AI PRIMARY CARE CONSULTATION SYSTEM{Style.RESET_ALL}".center(70))
-        print("=" * 70)
-        print(f"{Fore.YELLOW}⚕️  Virtual Medical Assistant - Available 24/7 ⚕️{Fore.RESET}".center(70))
-        print("=" * 70)
+        # Load readline up front (line editing + up-arrow recall) so the first
+        # input() does not stall on its lazy initialization
+        try:
+            import readline
+            readline.set_history_length(100)
+        except ImportError:
+            pass
+        
+        # Special commands accepted at the symptom prompt; a truthy return ends the session
+        self._commands = {
+            "quit": self._do_quit,
+            "exit": self._do_quit,
+            "help": self.print_instructions,
+            "history": self.view_history,
+        }
+        
+    def _build_banners(self) -> dict:
+        """Pre-format the static screens once colors are resolved"""
+        header = "\n".join([
+            "\n" + "=" * 70,
+            f"{Style.BRIGHT}{Fore.CYAN}AI PRIMARY CARE CONSULTATION SYSTEM{Style.RESET_ALL}".center(70),
+            "=" * 70,
+            f"{Fore.YELLOW}⚕️  Virtual Medical Assistant - Available 24/7 ⚕️{Fore.RESET}".center(70),
+            "=" * 70,
+        ]) + "\n"
         
-    def print_disclaimer(self):
-        """Print medical disclaimer"""
         disclaimer = f"""
 {Fore.RED}{Style.BRIGHT}IMPORTANT MEDICAL DISCLAIMER:{Style.RESET_ALL}
 {Fore.YELLOW}• This system provides general health information only
@@ -59,11 +159,7 @@ class ConsultationCLI:
 • For emergencies, call 911 immediately
 • Always consult a healthcare provider for medical concerns{Fore.RESET}
 """
-        print(disclaimer)
-        print("=" * 70)
         
-    def print_instructions(self):
-        """Print usage instructions"""
         instructions = f"""
 {Fore.GREEN}How to use this system:{Fore.RESET}
 1. Describe your symptoms clearly
@@ -76,42 +172,69 @@ class ConsultationCLI:
 • Type 'help' for more information
 • Type 'history' to view consultation history
 """
-        print(instructions)
+        
+        return {
+            "header": header,
+            "disclaimer": disclaimer + "\n" + "=" * 70 + "\n",
+            "instructions": instructions + "\n",
+            "goodbye_prefix": "\n" + "=" * 70 + "\n"
+                f"{Fore.CYAN}Thank you for using the AI Primary Care Consultation System{Fore.RESET}\n",
+            "goodbye_suffix": f"\n{Fore.YELLOW}Remember: For emergencies, always call 911{Fore.RESET}\n"
+                f"{Fore.GREEN}Stay healthy! 👋{Fore.RESET}\n" + "=" * 70 + "\n",
+        }
+        
+    def _build_final_banners(self) -> dict:
+        """Pre-format the final response headers, keyed by is_emergency"""
+        def banner(title: str) -> str:
+            return "\n".join(["\n" + "=" * 70, title.center(70), "=" * 70]) + "\n"
+        
+        return {
+            True: banner(f"{Back.RED}{Fore.WHITE}{Style.BRIGHT}URGENT MEDICAL ATTENTION REQUIRED{Style.RESET_ALL}"),
+            False: banner(f"{Fore.GREEN}{Style.BRIGHT}CONSULTATION SUMMARY{Style.RESET_ALL}"),
+        }
+        
+    def print_header(self):
+        """Print application header"""
+        _write(self._BANNERS["header"])
+        
+    def print_disclaimer(self):
+        """Print medical disclaimer"""
+        _write(self._BANNERS["disclaimer"])
+        
+    def print_instructions(self):
+        """Print usage instructions"""
+        _write(self._BANNERS["instructions"])
         
     def get_patient_input(self, prompt: str = "You: ") -> str:
         """Get input from patient with formatting"""
-        print(f"{Fore.GREEN}{prompt}{Fore.RESET}", end="")
+        # Flush before blocking so the prompt is visible immediately
+        _write(f"{Fore.GREEN}{prompt}{Fore.RESET}")
         return input()
     
     def print_assistant_message(self, message: str):
         """Print assistant message with formatting"""
-        print(f"\n{Fore.CYAN}Assistant: {Fore.RESET}{message}\n")
+        _write(f"\n{Fore.CYAN}Assistant: {Fore.RESET}{message}\n\n")
+    
+    def _format_emergency_message(self, message: str) -> str:
+        return (f"\n{Back.RED}{Fore.WHITE}{Style.BRIGHT}⚠️  EMERGENCY RESPONSE ⚠️{Style.RESET_ALL}\n"
+                f"{Fore.RED}{Style.BRIGHT}{message}{Style.RESET_ALL}\n\n")
     
     def print_emergency_message(self, message: str):
         """Print emergency message with special formatting"""
-        print(f"\n{Back.RED}{Fore.WHITE}{Style.BRIGHT}⚠️  EMERGENCY RESPONSE ⚠️{Style.RESET_ALL}")
-        print(f"{Fore.RED}{Style.BRIGHT}{message}{Style.RESET_ALL}\n")
+        _write(self._format_emergency_message(message))
     
     def print_final_response(self, response: str, is_emergency: bool = False):
         """Print the final consultation response with appropriate formatting"""
-        print("\n" + "=" * 70)
         if is_emergency:
-            print(f"{Back.RED}{Fore.WHITE}{Style.BRIGHT}URGENT MEDICAL ATTENTION REQUIRED{Style.RESET_ALL}".center(70))
+            body = self._format_emergency_message(response)
         else:
-            print(f"{Fore.GREEN}{Style.BRIGHT}CONSULTATION SUMMARY{Style.RESET_ALL}".center(70))
-        print("=" * 70)
-        
-        if is_emergency:
-            self.print_emergency_message(response)
-        else:
-            print(f"{Fore.CYAN}{response}{Fore.RESET}")
-        
-        print("=" * 70)
+            body = f"{Fore.CYAN}{response}{Fore.RESET}\n"
+        _write(self._FINAL_BANNERS[is_emergency] + body + "=" * 70 + "\n")
     
     def save_consultation(self, complaint: str, response: str, patient_data: dict):
         """Save consultation to history file"""
         consultation = {
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": self._now().isoformat(),
             "consultation_number": self.consultation_count,
             "initial_complaint": complaint,
             "final_response": response,
@@ -119,50 +242,43 @@ class ConsultationCLI:
             "handoff_status": patient_data.get("handoff_status", "unknown")
         }
         
-        history_file = "consultation_history.json"
-        
         try:
-            # Load existing history
-            if os.path.exists(history_file):
-                with open(history_file, "r") as f:
-                    history = json.load(f)
-            else:
-                history = []
-            
-            # Append new consultation
-            history.append(consultation)
+            # Append-only: one compact JSON record per line, on a handle kept for the session
+            if self._history_fp is None:
+                self._history_fp = open(HISTORY_FILE, "a+b")
+                # Terminate a partial record left by an interrupted append
+                if self._history_fp.seek(0, os.SEEK_END) > 0:
+                    self._history_fp.seek(-1, os.SEEK_END)
+                    if self._history_fp.read(1) != b"\n":
+                        self._history_fp.write(b"\n")
+            self._history_fp.write(json_dumps_bytes(consultation) + b"\n")
+            self._history_fp.flush()
             
-            # Save updated history
-            with open(history_file, "w") as f:
-                json.dump(history, f, indent=2)
-                
             print(f"{Fore.GREEN}✓ Consultation saved to history{Fore.RESET}")
         except Exception as e:
             print(f"{Fore.YELLOW}Note: Could not save consultation history: {e}{Fore.RESET}")
     
     def view_history(self):
         """View consultation history"""
-        history_file = "consultation_history.json"
-        
-        if not os.path.exists(history_file):
+        if not os.path.exists(HISTORY_FILE):
             print(f"{Fore.YELLOW}No consultation history found.{Fore.RESET}")
             return
         
         try:
-            with open(history_file, "r") as f:
-                history = json.load(f)
+            recent = _tail_records(HISTORY_FILE, n=5)  # Show last 5
             
-            print(f"\n{Fore.CYAN}{Style.BRIGHT}CONSULTATION HISTORY{Style.RESET_ALL}")
-            print("=" * 70)
+            lines = [f"\n{Fore.CYAN}{Style.BRIGHT}CONSULTATION HISTORY{Style.RESET_ALL}", "=" * 70]
             
-            for i, consultation in enumerate(history[-5:], 1):  # Show last 5
-                timestamp = datetime.fromisoformat(consultation["timestamp"])
-                print(f"\n{Fore.GREEN}#{i} - {timestamp.strftime('%Y-%m-%d %H:%M')}{Fore.RESET}")
-                print(f"Complaint: {consultation['initial_complaint'][:50]}...")
-                print(f"Severity: {consultation['severity']}/10")
-                print(f"Status: {consultation['handoff_status']}")
+            for i, consultation in enumerate(recent, 1):
+                # Stored ISO timestamps already start with "YYYY-MM-DDTHH:MM"
+                timestamp = consultation["timestamp"][:16].replace("T", " ")
+                lines.append(f"\n{Fore.GREEN}#{i} - {timestamp}{Fore.RESET}")
+                lines.append(f"Complaint: {consultation['initial_complaint'][:50]}...")
+                lines.append(f"Severity: {consultation['severity']}/10")
+                lines.append(f"Status: {consultation['handoff_status']}")
             
-            print("\n" + "=" * 70)
+            lines.append("\n" + "=" * 70)
+            _write("\n".join(lines) + "\n")
         except Exception as e:
             print(f"{Fore.RED}Error reading history: {e}{Fore.RESET}")
     
@@ -175,14 +291,12 @@ class ConsultationCLI:
         self.system.conversation_history = []
         exchange_count = 1
         current_input = initial_complaint
-        conversation_history = []
         
         while exchange_count <= 5:
-            conversation_history.append(f"Patient: {current_input}")
             self.system.conversation_history.append(f"Patient: {current_input}")
             
             # Get response from history agent
-            question, patient_data = self.system.history_agent(current_input, exchange_count)
+            question, patient_data = self._run(self.system.history_agent(current_input, exchange_count))
             
             if patient_data:
                 # Handoff triggered
@@ -194,23 +308,22 @@ class ConsultationCLI:
                     print(f"\n{Fore.YELLOW}Processing your information...{Fore.RESET}")
                 
                 # Get decision from decision agent
-                decision = self.system.decision_agent(patient_data)
+                decision = self._run(self.system.decision_agent(patient_data))
                 
                 # Polish with communication agent
-                final_response = self.system.communication_agent(decision)
+                final_response = self._run(self.system.communication_agent(decision))
                 
                 return final_response, patient_data, is_emergency
             
             elif question:
                 # Continue conversation
-                conversation_history.append(f"Assistant: {question}")
                 self.system.conversation_history.append(f"Assistant: {question}")
                 self.print_assistant_message(question)
                 
                 current_input = self.get_patient_input()
                 exchange_count += 1
                 
-                if current_input.lower() in ['quit', 'exit']:
+                if current_input.strip().lower() in _QUIT_COMMANDS:
                     return "Consultation cancelled by user.", {}, False
         
         # Forced handoff at exchange limit
@@ -224,8 +337,8 @@ class ConsultationCLI:
             "red_flags": {"present": [], "ruled_out": []}
         }
         
-        decision = self.system.decision_agent(patient_data)
-        final_response = self.system.communication_agent(decision)
+        decision = self._run(self.system.decision_agent(patient_data))
+        final_response = self._run(self.system.communication_agent(decision))
         
         return final_response, patient_data, False
     
@@ -241,16 +354,13 @@ class ConsultationCLI:
                 user_input = self.get_patient_input("\nDescribe your symptoms (or type 'quit' to exit): ")
                 
                 # Handle special commands
-                if user_input.lower() in ['quit', 'exit']:
-                    self.print_goodbye()
-                    break
-                elif user_input.lower() == 'help':
-                    self.print_instructions()
-                    continue
-                elif user_input.lower() == 'history':
-                    self.view_history()
+                command = user_input.strip().lower()
+                handler = self._commands.get(command)
+                if handler:
+                    if handler():
+                        break
                     continue
-                elif not user_input.strip():
+                if not command:
                     print(f"{Fore.YELLOW}Please describe your symptoms or type 'quit' to exit.{Fore.RESET}")
                     continue
                 
@@ -265,7 +375,7 @@ class ConsultationCLI:
                 
                 # Ask if user wants another consultation
                 another = self.get_patient_input("\nWould you like to start another consultation? (yes/no): ")
-                if another.lower() not in ['yes', 'y']:
+                if another.strip().lower() not in _YES_ANSWERS:
                     self.print_goodbye()
                     break
                     
@@ -277,18 +387,48 @@ class ConsultationCLI:
                 print(f"\n{Fore.RED}An error occurred: {e}{Fore.RESET}")
                 print(f"{Fore.YELLOW}Please try again or contact support if the issue persists.{Fore.RESET}")
     
+    def _run(self, coro):
+        """Run an agent coroutine to completion on the session's event loop"""
+        return self._loop.run_until_complete(coro)
+    
+    def close(self):
+        """Release the history file handle and the API client's HTTP session"""
+        if self._history_fp is not None:
+            self._history_fp.close()
+            self._history_fp = None
+        if not self._loop.is_closed():
+            self._run(self.system.aclose())
+            self._loop.close()
+    
+    def _do_quit(self) -> bool:
+        """Handle 'quit'/'exit': say goodbye and stop the main loop"""
+        self.print_goodbye()
+        return True
+    
     def print_goodbye(self):
         """Print goodbye message with session summary"""
-        session_duration = datetime.now() - self.session_start
+        session_duration = self._now() - self.session_start
         minutes = int(session_duration.total_seconds() / 60)
         
-        print("\n" + "=" * 70)
-        print(f"{Fore.CYAN}Thank you for using the AI Primary Care Consultation System{Fore.RESET}")
-        print(f"Session duration: {minutes} minutes")
-        print(f"Consultations completed: {self.consultation_count}")
-        print(f"\n{Fore.YELLOW}Remember: For emergencies, always call 911{Fore.RESET}")
-        print(f"{Fore.GREEN}Stay healthy! 👋{Fore.RESET}")
-        print("=" * 70)
+        _write(
+            self._BANNERS["goodbye_prefix"]
+            + f"Session duration: {minutes} minutes\n"
+            + f"Consultations completed: {self.consultation_count}\n"
+            + self._BANNERS["goodbye_suffix"]
+        )
+
+
+def _sniff_flags(argv: list, flags) -> set:
+    """Return the flags present in argv, honoring argparse-style prefixes and --flag=value"""
+    present = set()
+    for arg in argv:
+        if arg == "--":
+            break
+        name = arg.split("=", 1)[0]
+        for flag in flags:
+            if name == flag or (name.startswith("--") and len(name) > 2 and flag.startswith(name)):
+                present.add(flag)
+    return present
 
 
 def main():
@@ -313,28 +453,41 @@ def main():
         help="Environment configuration to use"
     )
     
-    parser.add_argument(
-        "--model",
-        type=str,
-        choices=Config.AVAILABLE_MODELS,
-        default=Config.MODEL_NAME,
-        help="OpenAI model to use"
-    )
-    
-    parser.add_argument(
-        "--test",
-        action="store_true",
-        help="Run test suite instead of starting consultation"
-    )
+    # Optional flags are only registered when they (or --help) appear on the
+    # command line, so the common path skips building their actions.
+    def add_model_argument():
+        parser.add_argument(
+            "--model",
+            type=str,
+            default=None,
+            help=f"OpenAI model to use (one of: {', '.join(sorted(Config.AVAILABLE_MODELS))})"
+        )
+
+    def add_test_argument():
+        parser.add_argument(
+            "--test",
+            action="store_true",
+            help="Run test suite instead of starting consultation"
+        )
+
+    optional_arguments = {"--model": add_model_argument, "--test": add_test_argument}
+    requested = _sniff_flags(sys.argv[1:], optional_arguments)
+    if _sniff_flags(sys.argv[1:], ("-h", "--help")):
+        requested = set(optional_arguments)
+    for flag in optional_arguments:
+        if flag in requested:
+            optional_arguments[flag]()
     
     args = parser.parse_args()
     
     # Run tests if requested
-    if args.test:
+    if getattr(args, "test", False):
         from test_medical_system import run_tests
         success = run_tests()
         sys.exit(0 if success else 1)
     
+    _init_color()
+
     # Check for API key
     if not args.api_key:
         print(f"{Fore.RED}Error: OpenAI API key is required.{Fore.RESET}")
@@ -342,14 +495,18 @@ def main():
         sys.exit(1)
     
     # Start the CLI
+    cli = None
     try:
-        cli = ConsultationCLI(args.api_key, args.environment, args.model)
+        cli = ConsultationCLI(args.api_key, args.environment, getattr(args, "model", None))
         cli.run()
     except KeyboardInterrupt:
         print(f"\n{Fore.YELLOW}Application terminated by user.{Fore.RESET}")
     except Exception as e:
         print(f"{Fore.RED}Fatal error: {e}{Fore.RESET}")
         sys.exit(1)
+    finally:
+        if cli is not None:
+            cli.close()
 
 
 if __name__ == "__main__":
@@ -2,19 +2,91 @@
 Configuration file for AI Primary Care Consultation System
 """
 
+import functools
 import os
-from typing import List, Dict
+import re
+import sys
+from types import MappingProxyType
+from typing import Any, Callable, Iterable, List, Dict, Mapping
+
+# pyahocorasick is optional; a compiled regex alternation is used without it
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# orjson is optional; the stdlib json module is used without it
+try:
+    import orjson
+except ImportError:
+    import json
+    orjson = None
+
+
+def _freeze(table: Dict[str, Any]) -> Mapping[str, Any]:
+    """Return a read-only view of a lookup table with interned keys and tuple values"""
+    return MappingProxyType({
+        sys.intern(key): tuple(value) if isinstance(value, list) else value
+        for key, value in table.items()
+    })
+
+
+def build_phrase_pattern(phrases: Iterable[str]) -> "re.Pattern":
+    """Regex reporting every phrase occurrence as group(1) of finditer() matches"""
+    # Zero-width lookahead so overlapping phrases ("sudden severe headache" /
+    # "severe headache") are all reported, longest first at each position
+    alternation = "|".join(re.escape(p) for p in sorted(phrases, key=len, reverse=True))
+    return re.compile(f"(?=({alternation}))")
+
+
+def build_phrase_automaton(words: Mapping[str, Any]):
+    """Aho-Corasick automaton yielding (end, value) for each word found, or None without pyahocorasick"""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for word, value in words.items():
+        automaton.add_word(word, value)
+    automaton.make_automaton()
+    return automaton
+
+
+def _build_phrase_matcher(phrases: List[str]) -> Callable[[str], List[str]]:
+    """Build a single-pass matcher returning every phrase found in lowercase text"""
+    automaton = build_phrase_automaton({phrase: phrase for phrase in phrases})
+    if automaton is not None:
+        return lambda text: list(dict.fromkeys(phrase for _, phrase in automaton.iter(text)))
+    pattern = build_phrase_pattern(phrases)
+    return lambda text: list(dict.fromkeys(m.group(1) for m in pattern.finditer(text)))
+
+
+def json_loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def json_dumps_bytes(obj, indent: bool = False, sort_keys: bool = False) -> bytes:
+    """Serialize to UTF-8 JSON bytes, compact unless indent"""
+    if orjson is not None:
+        option = (orjson.OPT_INDENT_2 if indent else 0) | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, option=option)
+    return json_dumps(obj, indent, sort_keys).encode()
+
+
+def json_dumps(obj, indent: bool = False, sort_keys: bool = False) -> str:
+    if orjson is not None:
+        return json_dumps_bytes(obj, indent, sort_keys).decode()
+    return json.dumps(obj, indent=2 if indent else None, sort_keys=sort_keys,
+                      separators=None if indent else (",", ":"))
 
 class Config:
     """Configuration settings for the medical consultation system"""
     
     # Supported OpenAI models for this project
-    AVAILABLE_MODELS = [
+    AVAILABLE_MODELS = frozenset({
         "gpt-4o-mini",
         "gpt-4o",
         "gpt-4",
         "gpt-3.5-turbo",
-    ]
+    })
 
     # OpenAI API Configuration
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "your-api-key-here")
@@ -25,11 +97,11 @@ class Config:
     MAX_CLARIFICATIONS_PER_TOPIC = 2
     
     # Temperature settings for different agents
-    TEMPERATURE_SETTINGS = {
+    TEMPERATURE_SETTINGS = _freeze({
         "history_agent": 0.7,
         "decision_agent": 0.3,  # Lower for more consistent medical decisions
         "communication_agent": 0.5
-    }
+    })
     
     # Red Flags - Critical symptoms requiring immediate attention
     RED_FLAGS = [
@@ -64,22 +136,33 @@ class Config:
         "anaphylaxis", "severe burn", "severe injury"
     ]
     
+    # Whole-word keywords used to group RED_FLAGS into categories
+    RED_FLAG_CATEGORY_KEYWORDS = {
+        "cardiac": frozenset({"chest", "heart", "heartbeat"}),
+        "respiratory": frozenset({"breath", "breathe", "breathing", "choking", "wheezing"}),
+        "neurological": frozenset({"headache", "confusion", "speech", "seizure", "vision"}),
+        "bleeding": frozenset({"blood", "bleeding"}),
+        "mental_health": frozenset({"suicidal", "suicide", "harm", "homicidal"}),
+        "severe_pain": frozenset({"pain"}),
+        "other": frozenset({"overdose", "poisoning", "allergic", "burn", "injury"})
+    }
+    
     # Required questions for history taking
-    REQUIRED_QUESTIONS = {
+    REQUIRED_QUESTIONS = _freeze({
         "chief_complaint": "What brings you in today?",
         "timeline": "When did this first start, and has it been getting better, worse, or staying the same?",
         "severity": "On a scale of 1 to 10, how would you rate your discomfort or pain?",
         "patient_concern": "What concerns you most about this?"
-    }
+    })
     
     # Escalation timeframes based on urgency
-    ESCALATION_TIMEFRAMES = {
+    ESCALATION_TIMEFRAMES = _freeze({
         "emergency": "Call 911 immediately",
         "urgent": "Go to the emergency room immediately",
         "semi_urgent": "See a doctor within 24 hours",
         "routine_urgent": "Schedule an appointment within 2-3 days",
         "routine": "Schedule an appointment within 1-2 weeks"
-    }
+    })
     
     # Communication replacements for empathetic response
     COMMUNICATION_REPLACEMENTS = {
@@ -119,16 +202,16 @@ class Config:
     ]
     
     # Empathy phrases for different situations
-    EMPATHY_PHRASES = {
+    EMPATHY_PHRASES = _freeze({
         "pain": "That sounds really uncomfortable",
         "worry": "It's completely understandable that you're concerned about",
         "fear": "I can understand why this would be frightening",
         "frustration": "I understand this must be frustrating",
         "exhaustion": "That sounds exhausting to deal with"
-    }
+    })
     
     # Self-care recommendations database
-    SELF_CARE_TEMPLATES = {
+    SELF_CARE_TEMPLATES = _freeze({
         "headache": [
             "Rest in a quiet, dark room for 20-30 minutes",
             "Apply a cold compress to your forehead or temples",
@@ -164,7 +247,13 @@ class Config:
             "Keep the injured area elevated above heart level when possible",
             "Take over-the-counter pain relievers as directed"
         ]
-    }
+    })
+    
+    # Response cache for the decision/communication agents
+    SEMANTIC_CACHE_ENABLED = True
+    SEMANTIC_CACHE_THRESHOLD = 0.92  # Minimum cosine similarity for a hit
+    SEMANTIC_CACHE_TTL_SECONDS = 3600
+    SEMANTIC_CACHE_MAX_ENTRIES = 256
     
     # Logging configuration
     LOG_LEVEL = "INFO"
@@ -194,16 +283,52 @@ class Config:
         return True
     
     @classmethod
+    @functools.lru_cache(maxsize=None)
+    def _red_flag_matcher(cls) -> Callable[[str], List[str]]:
+        return _build_phrase_matcher(cls.RED_FLAGS)
+    
+    @classmethod
+    def scan_red_flags(cls, text: str) -> List[str]:
+        """Return the red flags mentioned in text, scanning it in a single pass"""
+        return cls._red_flag_matcher()(text.lower())
+    
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def _replacement_pattern(cls) -> "re.Pattern":
+        # Whole words/phrases only, so "bid" leaves "forbidden" alone; longest
+        # keys first so overlapping phrases resolve to the longest match
+        keys = sorted(cls.COMMUNICATION_REPLACEMENTS, key=len, reverse=True)
+        return re.compile(r"\b(?:" + "|".join(re.escape(k) for k in keys) + r")\b", re.IGNORECASE)
+    
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def _replacement_table(cls) -> Dict[str, str]:
+        return {k.lower(): v for k, v in cls.COMMUNICATION_REPLACEMENTS.items()}
+    
+    @classmethod
+    def apply_replacements(cls, text: str) -> str:
+        """Apply COMMUNICATION_REPLACEMENTS to text in a single regex pass"""
+        table = cls._replacement_table()
+        
+        def replace(m: "re.Match") -> str:
+            word = m.group(0)
+            replacement = table[word.lower()]
+            # Keep a capitalized word (e.g. at a sentence start) capitalized;
+            # all-caps abbreviations such as OTC are not capitalization cues
+            if word[0].isupper() and not word.isupper():
+                return replacement[0].upper() + replacement[1:]
+            return replacement
+        
+        return cls._replacement_pattern().sub(replace, text)
+    
+    @classmethod
+    @functools.lru_cache(maxsize=None)
     def get_red_flag_categories(cls) -> Dict[str, List[str]]:
-        """Organize red flags by category for better processing"""
+        """Organize red flags by category for better processing (computed once per class)"""
+        tokens = {f: frozenset(f.split()) for f in cls.RED_FLAGS}
         return {
-            "cardiac": [f for f in cls.RED_FLAGS if any(word in f for word in ["chest", "heart"])],
-            "respiratory": [f for f in cls.RED_FLAGS if any(word in f for word in ["breath", "choking", "wheez"])],
-            "neurological": [f for f in cls.RED_FLAGS if any(word in f for word in ["headache", "confusion", "speech", "seizure", "vision"])],
-            "bleeding": [f for f in cls.RED_FLAGS if "blood" in f or "bleeding" in f],
-            "mental_health": [f for f in cls.RED_FLAGS if any(word in f for word in ["suicid", "harm", "homicid"])],
-            "severe_pain": [f for f in cls.RED_FLAGS if "pain" in f],
-            "other": [f for f in cls.RED_FLAGS if any(word in f for word in ["overdose", "poison", "allergic", "burn", "injury"])]
+            category: [f for f in cls.RED_FLAGS if keywords & tokens[f]]
+            for category, keywords in cls.RED_FLAG_CATEGORY_KEYWORDS.items()
         }
 
 
@@ -230,6 +355,12 @@ class TestConfig(Config):
     REQUIRE_CONFIRMATION = False
 
 
+@functools.lru_cache(maxsize=None)
+def _validate_once(config_class) -> bool:
+    """Validate a config class the first time it is requested (failures are not cached)"""
+    return config_class.validate_config()
+
+
 def get_config(environment: str = "development") -> Config:
     """Get configuration based on environment"""
     configs = {
@@ -239,5 +370,5 @@ def get_config(environment: str = "development") -> Config:
     }
     
     config_class = configs.get(environment.lower(), DevelopmentConfig)
-    config_class.validate_config()
+    _validate_once(config_class)
     return config_class
@@ -3,15 +3,51 @@ AI Primary Care Consultation System
 A 3-agent sequential pipeline for medical consultation with safety mechanisms
 """
 
+import asyncio
+import atexit
+import bisect
+import importlib.util
+import itertools
 import json
+import queue
+import random
 import re
-from typing import Dict, List, Optional, Tuple, Any
-from dataclasses import dataclass, asdict
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Any, AsyncIterator, Callable, Final
+from dataclasses import dataclass
 from enum import Enum
-from openai import OpenAI
+from openai import AsyncOpenAI, APIConnectionError, InternalServerError, RateLimitError
+from config import build_phrase_automaton, build_phrase_pattern, json_dumps, json_loads
 from datetime import datetime
 import logging
 
+# The aiohttp transport needs the "openai[aiohttp]" extra; without it the SDK
+# falls back to its default httpx transport
+try:
+    from openai import DefaultAioHttpClient
+except ImportError:
+    DefaultAioHttpClient = None
+
+try:
+    import httpx
+    from openai import DefaultAsyncHttpxClient
+except ImportError:
+    DefaultAsyncHttpxClient = None
+
+# numpy is only needed when a SemanticCache is in use
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# tiktoken is optional; without it token counts are estimated
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -22,6 +58,225 @@ logging.getLogger("openai").setLevel(logging.WARNING)
 logging.getLogger("openai._base_client").setLevel(logging.WARNING)
 
 
+def _default_http_client():
+    """
+    Return an aiohttp-backed client if available, else an HTTP/2 httpx client
+    when h2 is installed, else None for the SDK default
+    """
+    if DefaultAioHttpClient is not None:
+        try:
+            return DefaultAioHttpClient()
+        except RuntimeError:
+            # openai is installed but the aiohttp extra is not
+            pass
+    if DefaultAsyncHttpxClient is not None and importlib.util.find_spec("h2") is not None:
+        # Multiplex back-to-back agent calls over one TLS connection
+        return DefaultAsyncHttpxClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+        )
+    return None
+
+
+_HISTORY_SYSTEM_PROMPT: Final[str] = """You are a medical history-taking assistant. Your job is to gather symptom information efficiently.
+
+REQUIRED QUESTIONS (must ask if not yet answered):
+Chief complaint: "What are your symptoms?"
+Timeline: "When did this first start, and has it been getting better, worse, or staying the same?"
+Severity: "Rate your discomfort/pain from 1-10"
+Patient concern: "What concerns you most about this?"
+
+RULES:
+- Maximum 5 total exchanges before handoff
+- Maximum 2 clarifying follow-ups per topic
+- Be energetic, friendly, and helpful
+- Monitor for red flags continuously, and if any are detected, handoff immediately.
+
+RED FLAGS (immediate handoff):
+- Chest pain/pressure/tightness
+- Difficulty breathing
+- Severe pain (8+/10)
+- Sudden severe headache/"worst headache ever"
+- Confusion, slurred speech, one-sided weakness
+- Heavy bleeding
+- Suicidal ideation
+
+Always reply with a single JSON object and nothing else.
+
+If exchange_count >= 5 or all required info gathered or red flag detected, reply with the handoff object:
+{
+  "handoff_status": "EMERGENCY" | "COMPLETE" | "INCOMPLETE",
+  "exchange_count": <number>,
+  "chief_complaint": "<complaint>",
+  "severity": <1-10>,
+  "timeline": {
+    "started": "<when>",
+    "trend": "better" | "worse" | "stable"
+  },
+  "symptom_details": {
+    "location": "<where>",
+    "quality": "<description>",
+    "characteristics": "<details>"
+  },
+  "associated_symptoms": ["<symptom1>", "<symptom2>"],
+  "red_flags": {
+    "present": ["<flag1>"],
+    "ruled_out": ["<flag2>"]
+  },
+  "patient_concern": "<concern>",
+  "relevant_history": "<history>"
+}
+
+Otherwise, ask the next most important question by replying:
+{"next_question": "<question>"}"""
+
+_DECISION_SYSTEM_PROMPT: Final[str] = """You are a medical triage and decision assistant. Parse the patient data and make treatment decisions.
+
+DECISION LOGIC:
+1. IF handoff_status == "EMERGENCY" → Generate escalation (Call 911/ER/urgent care)
+2. IF handoff_status == "INCOMPLETE" OR uncertain diagnosis → Conservative escalation (see doctor within X hours/days)
+3. IF mild symptoms, no red flags → Generate 3-step treatment plan
+
+TREATMENT OUTPUT FORMAT:
+1. [First self-care recommendation]
+2. [Second self-care recommendation]
+3. [Third self-care recommendation]
+
+"If this isn't improving in [X] days, please contact your doctor."
+"I can provide guidance, but I cannot replace an in-person examination."
+"How does this sound to you?"
+
+ESCALATION OUTPUT FORMAT:
+"Based on what you've told me, [assessment]. This is beyond what I can safely assess remotely. Here's what I recommend: [specific action with timeframe]."
+
+Conservative bias: When uncertain, default to escalation."""
+
+_COMMUNICATION_SYSTEM_PROMPT: Final[str] = """You are a medical communication specialist. Transform the medical response to be more empathetic and clear.
+
+REQUIRED TRANSFORMATIONS:
+You do not have to include all of these in your response, only transform if conditions are met.
+- "I see" / "I hear" → "I understand"
+- Medical jargon → lay terms (e.g., "hypertension" → "high blood pressure")
+- When worry expressed → "It's completely understandable that you're concerned about [specific symptom]"
+- When pain described → "That sounds really uncomfortable"
+- Never say "don't worry" → use "let's work through this together"
+
+MAINTAIN:
+- All clinical content and safety language
+- The structure and recommendations
+- Required phrases: "I can provide guidance, but I cannot replace an in-person examination" and "How does this sound to you?"
+
+Only modify communication style and word choice, not medical content."""
+
+# Each agent's system prompt is a fixed module constant sent first, so its
+# bytes are identical on every request; the dynamic content follows it. (A
+# combined three-agent prefix would stay under the 1024-token minimum for
+# OpenAI prompt caching while tripling input tokens for decision and
+# communication calls.)
+_AGENT_SYSTEM_PROMPTS: Final[Dict[str, str]] = {
+    "history": _HISTORY_SYSTEM_PROMPT,
+    "decision": _DECISION_SYSTEM_PROMPT,
+    "communication": _COMMUNICATION_SYSTEM_PROMPT,
+}
+
+# Self-reported pain of 8, 9 or 10 (optionally "/10" or "out of 10")
+_PAIN_RE: Final[re.Pattern] = re.compile(r'\b([8-9]|10)\s*(?:\/10|out of 10)?\b')
+
+# Leading key of a streamed history reply; handoff_status is the first field
+# of the handoff object, so an emergency is known after a handful of tokens
+_STREAM_STATUS_RE: Final[re.Pattern] = re.compile(r'"handoff_status"\s*:\s*"(\w+)"|"next_question"')
+
+# Models that accept response_format={"type": "json_object"}
+_JSON_MODE_MODELS: Final[frozenset] = frozenset({"gpt-4o-mini", "gpt-4o", "gpt-4-turbo", "gpt-3.5-turbo"})
+
+
+# model -> token counting function, filled by _load_token_counter
+_TOKEN_COUNTERS: Dict[str, Callable[[str], int]] = {}
+
+# tiktoken downloads encoding files without a timeout; give up on it after this long
+_TOKEN_COUNTER_LOAD_TIMEOUT: Final[float] = 5.0
+
+
+def _estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def _load_token_counter(model: str) -> Callable[[str], int]:
+    """Token counting function for model (exact with tiktoken, else ~4 chars/token)"""
+    counter = _TOKEN_COUNTERS.get(model)
+    if counter is not None:
+        return counter
+    counter = _estimate_tokens
+    if tiktoken is not None:
+        try:
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                encoding = tiktoken.get_encoding("cl100k_base")
+            counter = lambda text: len(encoding.encode(text))
+        except Exception as e:
+            # e.g. the encoding file cannot be downloaded
+            logger.warning(f"tiktoken unavailable for {model}, estimating token counts: {e}")
+    _TOKEN_COUNTERS[model] = counter
+    return counter
+
+
+async def _token_counter(model: str) -> Callable[[str], int]:
+    """_load_token_counter without blocking the loop: the first load may download a BPE file"""
+    counter = _TOKEN_COUNTERS.get(model)
+    if counter is None:
+        # A daemon thread rather than to_thread: a hung download must not block
+        # executor shutdown or interpreter exit
+        loop = asyncio.get_running_loop()
+        loaded = loop.create_future()
+        
+        def load():
+            result = _load_token_counter(model)
+            try:
+                loop.call_soon_threadsafe(lambda: loaded.done() or loaded.set_result(result))
+            except RuntimeError:
+                pass  # the loop has been closed
+        
+        threading.Thread(target=load, name="tiktoken-load", daemon=True).start()
+        try:
+            counter = await asyncio.wait_for(loaded, _TOKEN_COUNTER_LOAD_TIMEOUT)
+        except asyncio.TimeoutError:
+            # Estimate from now on; a load that finishes late still replaces the estimator
+            logger.warning(f"tiktoken load for {model} timed out, estimating token counts")
+            counter = _TOKEN_COUNTERS.setdefault(model, _estimate_tokens)
+    return counter
+
+
+# Every severe pain rating _PAIN_RE can match contains one of these
+_PAIN_DIGITS: Final[Tuple[str, ...]] = ("8", "9", "10")
+
+
+def _build_red_flag_automaton(flags: Tuple[str, ...]):
+    """
+    Aho-Corasick automaton over the red flags plus _PAIN_DIGITS (stored with a
+    None value), so one pass finds the flags and tells whether _PAIN_RE can match
+    """
+    words = dict.fromkeys(_PAIN_DIGITS)
+    words.update((flag, flag) for flag in flags)
+    return build_phrase_automaton(words)
+
+
+def _decision_message(patient_data: Dict) -> str:
+    return f"Patient data:\n{json_dumps(patient_data, indent=True)}\n\nProvide appropriate response based on the decision logic."
+
+
+def _communication_message(decision_output: str) -> str:
+    return f"Transform this medical response:\n{decision_output}"
+
+
+def _build_messages(agent: str, user_message: str) -> List[Dict[str, str]]:
+    """The agent's fixed system prompt, then the dynamic user content"""
+    return [
+        {"role": "system", "content": _AGENT_SYSTEM_PROMPTS[agent]},
+        {"role": "user", "content": user_message},
+    ]
+
+
 class HandoffStatus(Enum):
     EMERGENCY = "EMERGENCY"
     COMPLETE = "COMPLETE"
@@ -34,7 +289,7 @@ class TrendStatus(Enum):
     STABLE = "stable"
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class PatientData:
     """Structure for patient information handoff between agents"""
     handoff_status: str
@@ -49,124 +304,531 @@ class PatientData:
     relevant_history: str = ""
 
     def to_json(self) -> str:
-        return json.dumps(asdict(self), indent=2)
+        # Direct field access instead of asdict(), which deep-copies every value
+        return json_dumps({
+            "handoff_status": self.handoff_status,
+            "exchange_count": self.exchange_count,
+            "chief_complaint": self.chief_complaint,
+            "severity": self.severity,
+            "timeline": self.timeline,
+            "symptom_details": self.symptom_details,
+            "associated_symptoms": self.associated_symptoms,
+            "red_flags": self.red_flags,
+            "patient_concern": self.patient_concern,
+            "relevant_history": self.relevant_history,
+        }, indent=True)
+
+
+class SemanticCache:
+    """
+    In-memory LLM response cache with an exact-match tier and an embedding tier.
+    Entries live in partitions (e.g. the decision agent's patient profile)
+    that must match exactly; only the free text is compared by cosine similarity.
+    Expired entries are dropped after ttl_seconds, least-recently-used beyond max_entries.
+    """
+    
+    EMBEDDING_MODEL = "text-embedding-3-small"
+    
+    def __init__(self, threshold: float = 0.92, ttl_seconds: float = 3600, max_entries: int = 256):
+        if np is None:
+            raise RuntimeError("SemanticCache requires numpy (pip install numpy)")
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # (partition, text) -> (normalized embedding or None, response, stored_at)
+        self._entries: "OrderedDict[Tuple[tuple, str], Tuple[Any, str, float]]" = OrderedDict()
+    
+    def _evict_expired(self):
+        cutoff = time.monotonic() - self.ttl_seconds
+        for key in [k for k, (_, _, stored_at) in self._entries.items() if stored_at < cutoff]:
+            del self._entries[key]
+    
+    def get_exact(self, partition: tuple, text: str) -> Optional[str]:
+        """Return the cached response stored under exactly this partition and text"""
+        self._evict_expired()
+        entry = self._entries.get((partition, text))
+        if entry is None:
+            return None
+        self._entries.move_to_end((partition, text))
+        return entry[1]
+    
+    def has_partition(self, partition: tuple) -> bool:
+        """Whether the partition holds any embedded entry for search() to compare against"""
+        self._evict_expired()
+        return any(key[0] == partition and entry[0] is not None for key, entry in self._entries.items())
+    
+    def search(self, partition: tuple, embedding) -> Optional[str]:
+        """Return the most similar cached response in the partition, if above threshold"""
+        self._evict_expired()
+        candidates = [(key, entry) for key, entry in self._entries.items()
+                      if key[0] == partition and entry[0] is not None]
+        if not candidates:
+            return None
+        similarities = np.stack([entry[0] for _, entry in candidates]) @ embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+        key, entry = candidates[best]
+        self._entries.move_to_end(key)
+        return entry[1]
+    
+    def add(self, partition: tuple, text: str, response: str, embedding=None):
+        """Store a response; embedding may be None for exact-match-only entries"""
+        self._entries[(partition, text)] = (embedding, response, time.monotonic())
+        self._entries.move_to_end((partition, text))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def set_embedding(self, partition: tuple, text: str, embedding):
+        """Attach an embedding to an existing entry (a no-op if it was evicted meanwhile)"""
+        entry = self._entries.get((partition, text))
+        if entry is not None:
+            self._entries[(partition, text)] = (embedding, entry[1], entry[2])
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Bounded retries with jittered exponential backoff and a per-attempt timeout"""
+    max_attempts: int = 5
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+    timeout: Optional[float] = 60.0  # Seconds per attempt; None waits on the SDK timeout only
+    # Rate limits, connection errors (including the SDK's APITimeoutError), 5xx
+    # responses and attempts cut off by timeout
+    retryable: Tuple[type, ...] = (RateLimitError, APIConnectionError, InternalServerError, asyncio.TimeoutError)
+    
+    def delay(self, attempt: int) -> float:
+        """Backoff before retrying after the given (1-based) attempt, with 50-100% jitter"""
+        return min(self.max_delay, self.base_delay * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+
+
+class RateLimitedClient:
+    """
+    Shared chat-completions client for concurrent consultations: bounds the
+    requests in flight, paces estimated token usage to a per-minute budget and
+    retries transient failures according to its RetryPolicy.
+    Pass one instance to several MedicalConsultationSystem objects to share the budget.
+    """
+    
+    def __init__(self, api_key: str, max_concurrent: int = 8, max_tokens_per_minute: int = 90_000,
+                 retry_policy: Optional[RetryPolicy] = None):
+        # Embeddings, files and batches keep the SDK's own retries; chat
+        # completions go through a copy (same HTTP pool) with them disabled so
+        # every retry waits on the shared budget
+        self.client = AsyncOpenAI(api_key=api_key, http_client=_default_http_client())
+        self._chat_client = self.client.with_options(max_retries=0)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._bucket_lock = asyncio.Lock()
+        self._capacity = float(max_tokens_per_minute)
+        self._refill_per_second = max_tokens_per_minute / 60.0
+        self._available = self._capacity
+        self._last_refill = time.monotonic()
+    
+    @staticmethod
+    def _estimate_tokens(params: Dict[str, Any]) -> int:
+        """Rough prompt (~4 chars/token) plus completion budget for one request"""
+        prompt_chars = sum(len(m["content"]) for m in params.get("messages", ()))
+        return prompt_chars // 4 + params.get("max_tokens", 0)
+    
+    async def _acquire_tokens(self, cost: int):
+        """Wait until the token bucket can cover cost, then spend it"""
+        cost = min(cost, self._capacity)
+        async with self._bucket_lock:
+            while True:
+                now = time.monotonic()
+                self._available = min(self._capacity,
+                                      self._available + (now - self._last_refill) * self._refill_per_second)
+                self._last_refill = now
+                if self._available >= cost:
+                    self._available -= cost
+                    return
+                await asyncio.sleep((cost - self._available) / self._refill_per_second)
+    
+    async def create(self, **params):
+        """chat.completions.create with concurrency, token pacing and retries"""
+        cost = self._estimate_tokens(params)
+        policy = self.retry_policy
+        for attempt in range(1, policy.max_attempts + 1):
+            # Every attempt (retries included) is charged against the shared budget
+            await self._acquire_tokens(cost)
+            await self._semaphore.acquire()
+            try:
+                response = await asyncio.wait_for(self._chat_client.chat.completions.create(**params),
+                                                  policy.timeout)
+            except policy.retryable as e:
+                self._semaphore.release()
+                if attempt == policy.max_attempts:
+                    raise
+                delay = policy.delay(attempt)
+                logger.warning(f"Retrying LLM request in {delay:.1f}s (attempt {attempt}): "
+                               f"{type(e).__name__}: {e}")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self._semaphore.release()
+                raise
+            if params.get("stream"):
+                # The slot stays taken while the body streams in
+                return _SemaphoreReleasingStream(response, self._semaphore)
+            self._semaphore.release()
+            return response
+    
+    async def close(self):
+        await self.client.close()
+
+
+class _SemaphoreReleasingStream:
+    """Async stream wrapper that frees its concurrency slot once finished or closed"""
+    
+    def __init__(self, stream, semaphore: asyncio.Semaphore):
+        self._stream = stream
+        self._semaphore = semaphore
+        self._released = False
+    
+    def _release(self):
+        if not self._released:
+            self._released = True
+            self._semaphore.release()
+    
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        finally:
+            self._release()
+    
+    async def close(self):
+        try:
+            await self._stream.close()
+        finally:
+            self._release()
 
 
 class MedicalConsultationSystem:
     """Main orchestrator for the 3-agent medical consultation system"""
     
     # Red flags that trigger emergency response
-    RED_FLAGS = [
+    RED_FLAGS: Final[Tuple[str, ...]] = (
         "chest pain", "chest pressure", "chest tightness",
         "difficulty breathing", "shortness of breath", "can't breathe",
         "severe pain", "worst headache", "sudden severe headache",
         "confusion", "slurred speech", "one-sided weakness",
         "heavy bleeding", "suicidal", "suicide"
-    ]
+    )
+    
+    # All red flags in one alternation that also reports overlapping phrases,
+    # matching the old per-flag substring checks
+    RED_FLAGS_RE = build_phrase_pattern(RED_FLAGS)
+    RED_FLAG_AUTOMATON = _build_red_flag_automaton(RED_FLAGS)
     
-    def __init__(self, api_key: str, model: str = "gpt-4"):
-        """Initialize the consultation system with OpenAI API"""
-        self.client = OpenAI(api_key=api_key)
+    # Token budget for the previous exchanges sent to the history agent
+    HISTORY_TOKEN_BUDGET = 2000
+    
+    # Completion budgets: history and decisions get the full MAX_TOKENS, the
+    # communication rewrite needs less
+    MAX_TOKENS = 500
+    COMMUNICATION_MAX_TOKENS = 300
+    
+    # Exact-match decision memo (LRU) for systems without a response cache,
+    # whose exact tier covers the same repeats; shared by every system in the
+    # process: (model, canonical patient data) -> (response, stored_at)
+    DECISION_MEMO_SIZE = 1024
+    _decision_memo: "OrderedDict[Tuple[str, str], Tuple[str, float]]" = OrderedDict()
+    
+    # The communication agent only restyles the decision text, so it runs on
+    # a smaller, faster model
+    COMMUNICATION_MODEL = "gpt-4o-mini"
+    
+    def __init__(self, api_key: str, model: str = "gpt-4", cache: Optional[SemanticCache] = None,
+                 client: Optional[RateLimitedClient] = None, decision_memo: bool = True,
+                 decision_memo_ttl_seconds: float = 3600):
+        """
+        Initialize the consultation system with OpenAI API (cache is optional).
+        Pass a shared RateLimitedClient to run several systems concurrently.
+        decision_memo=False disables the exact-match decision memo used when
+        no cache is given.
+        """
+        # One async client (and one pooled HTTP session) for every agent call
+        self._owns_client = client is None
+        self._api = RateLimitedClient(api_key) if client is None else client
+        self.client = self._api.client
         self.model = model
+        self.cache = cache
+        self.decision_memo = decision_memo
+        self.decision_memo_ttl_seconds = decision_memo_ttl_seconds
         self.conversation_history = []
         self.patient_data = None
+        # Cached per-entry token counts for conversation_history
+        self._counted_history = None
+        self._history_counts = []
+        self._history_tokens = 0
+        # Pending _embed_later tasks (held so they are not garbage-collected)
+        self._embed_tasks = set()
+    
+    async def aclose(self):
+        """Wait for queued log writes and cache embeddings, then close the HTTP session unless it is shared"""
+        await asyncio.to_thread(_AUDIT_LOG.flush)
+        if self._embed_tasks:
+            await asyncio.gather(*self._embed_tasks, return_exceptions=True)
+        if self._owns_client:
+            await self._api.close()
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
         
     def check_for_red_flags(self, text: str) -> List[str]:
         """Check if text contains any red flag symptoms"""
         text_lower = text.lower()
-        detected_flags = []
-        
-        for flag in self.RED_FLAGS:
-            if flag in text_lower:
-                detected_flags.append(flag)
+        # One pass over the text; dict.fromkeys de-duplicates in order of appearance
+        if self.RED_FLAG_AUTOMATON is not None:
+            hits = [flag for _, flag in self.RED_FLAG_AUTOMATON.iter(text_lower)]
+            detected_flags = list(dict.fromkeys(flag for flag in hits if flag is not None))
+            may_have_pain_rating = None in hits
+        else:
+            detected_flags = list(dict.fromkeys(m.group(1) for m in self.RED_FLAGS_RE.finditer(text_lower)))
+            may_have_pain_rating = True
                 
         # Check for high pain severity
-        pain_match = re.search(r'\b([8-9]|10)\s*(?:\/10|out of 10)?\b', text_lower)
+        pain_match = _PAIN_RE.search(text_lower) if may_have_pain_rating else None
         if pain_match:
             detected_flags.append(f"severe pain ({pain_match.group(0)})")
             
         return detected_flags
     
-    def call_llm(self, system_prompt: str, user_message: str, temperature: float = 0.7) -> str:
-        """Call OpenAI API with error handling"""
+    def check_for_red_flags_batch(self, texts: List[str]) -> List[List[str]]:
+        """
+        check_for_red_flags for many texts at once: each pattern runs once over
+        the joined texts and matches are mapped back to their text by offset
+        """
+        lowered = [text.lower() for text in texts]
+        # NUL is neither whitespace nor a word character, so no match spans two texts
+        joined = "\x00".join(lowered)
+        starts = list(itertools.accumulate((len(text) + 1 for text in lowered[:-1]), initial=0))
+        
+        found = [{} for _ in texts]
+        if self.RED_FLAG_AUTOMATON is not None:
+            for end, flag in self.RED_FLAG_AUTOMATON.iter(joined):
+                if flag is not None:
+                    found[bisect.bisect_right(starts, end) - 1].setdefault(flag)
+        else:
+            for m in self.RED_FLAGS_RE.finditer(joined):
+                found[bisect.bisect_right(starts, m.start()) - 1].setdefault(m.group(1))
+        detected = [list(flags) for flags in found]
+        
+        # Only the first pain match per text is reported
+        has_pain = [False] * len(texts)
+        for m in _PAIN_RE.finditer(joined):
+            i = bisect.bisect_right(starts, m.start()) - 1
+            if not has_pain[i]:
+                has_pain[i] = True
+                detected[i].append(f"severe pain ({m.group(0)})")
+        return detected
+    
+    async def _embed(self, text: str):
+        response = await self.client.embeddings.create(model=SemanticCache.EMBEDDING_MODEL, input=text)
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+    
+    def _embed_later(self, partition: tuple, text: str):
+        """Embed a freshly cached entry in the background so later calls can match it"""
+        async def embed():
+            try:
+                self.cache.set_embedding(partition, text, await self._embed(text))
+            except Exception as e:
+                logger.warning(f"Semantic cache embedding failed: {e}")
+        
+        task = asyncio.create_task(embed())
+        self._embed_tasks.add(task)
+        task.add_done_callback(self._embed_tasks.discard)
+    
+    async def call_llm(self, agent: str, user_message: str, temperature: float = 0.7,
+                       cache_key: Optional[Tuple[tuple, str]] = None, semantic: bool = True,
+                       response_format: Optional[Dict[str, str]] = None,
+                       max_tokens: Optional[int] = None, model: Optional[str] = None,
+                       truncated_fallback: Optional[str] = None) -> str:
+        """
+        Call OpenAI API with error handling as the given agent ("history",
+        "decision" or "communication").
+        cache_key=(partition, text) enables the response cache; semantic=False
+        restricts it to exact matches. response_format is passed through to
+        the API (e.g. JSON mode) when given; model overrides self.model and
+        max_tokens overrides MAX_TOKENS. A reply cut off at max_tokens is replaced by truncated_fallback, if given.
+        """
+        embedding = None
+        if cache_key is not None and self.cache is not None:
+            partition, text = cache_key
+            cached = self.cache.get_exact(partition, text)
+            # Only pay for an embeddings round trip when there is something to compare against
+            if cached is None and semantic and self.cache.has_partition(partition):
+                try:
+                    embedding = await self._embed(text)
+                    cached = self.cache.search(partition, embedding)
+                except Exception as e:
+                    # The cache is an optimization; fall through to a normal call
+                    logger.warning(f"Semantic cache lookup failed: {e}")
+                    embedding = None
+            if cached is not None:
+                logger.info(f"Response cache hit: {partition[0]}")
+                return cached
+        
+        try:
+            response = await self._api.create(
+                **self._completion_params(agent, user_message, temperature, response_format, max_tokens, model)
+            )
+            content = response.choices[0].message.content
+            finish_reason = response.choices[0].finish_reason
+            details = getattr(response.usage, "prompt_tokens_details", None)
+            if details is not None:
+                logger.debug(f"{agent} prompt tokens: {response.usage.prompt_tokens} "
+                             f"(cached: {getattr(details, 'cached_tokens', 0)})")
+        except Exception as e:
+            logger.error(f"LLM API error: {e}")
+            raise
+        
+        if finish_reason == "length" and truncated_fallback is not None:
+            logger.warning(f"{agent} reply truncated at max_tokens={max_tokens or self.MAX_TOKENS}; using fallback")
+            return truncated_fallback
+        
+        if cache_key is not None and self.cache is not None:
+            self.cache.add(cache_key[0], cache_key[1], content, embedding)
+            if semantic and embedding is None:
+                self._embed_later(cache_key[0], cache_key[1])
+        return content
+    
+    async def stream_llm(self, agent: str, user_message: str, temperature: float = 0.7,
+                         response_format: Optional[Dict[str, str]] = None, max_tokens: Optional[int] = None,
+                         model: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Streaming variant of call_llm (no response cache) that yields content
+        deltas. Closing the generator early cancels the rest of the generation.
+        """
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                temperature=temperature,
-                max_tokens=500
+            stream = await self._api.create(
+                stream=True,
+                **self._completion_params(agent, user_message, temperature, response_format, max_tokens, model)
             )
-            return response.choices[0].message.content
         except Exception as e:
             logger.error(f"LLM API error: {e}")
             raise
+        
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.close()
+    
+    def _completion_params(self, agent: str, user_message: str, temperature: float,
+                           response_format: Optional[Dict[str, str]] = None, max_tokens: Optional[int] = None,
+                           model: Optional[str] = None) -> Dict[str, Any]:
+        """Chat completion request parameters (also used as Batch API request bodies)"""
+        params = {
+            "model": model or self.model,
+            "messages": _build_messages(agent, user_message),
+            "temperature": temperature,
+            "max_tokens": max_tokens or self.MAX_TOKENS,
+        }
+        if response_format:
+            params["response_format"] = response_format
+        return params
     
-    def history_agent(self, patient_input: str, exchange_count: int = 1) -> Tuple[str, Optional[Dict]]:
+    async def history_agent(self, patient_input: str, exchange_count: int = 1,
+                            force_handoff: bool = False) -> Tuple[str, Optional[Dict]]:
         """
         Agent 1: History-Taking Agent
-        Gathers symptom information with bounded questioning
+        Gathers symptom information with bounded questioning.
+        force_handoff=True always returns patient data (no further question is possible).
         """
         
         # Check for immediate red flags
         red_flags = self.check_for_red_flags(patient_input)
         
-        system_prompt = """You are a medical history-taking assistant. Your job is to gather symptom information efficiently.
-
-REQUIRED QUESTIONS (must ask if not yet answered):
-Chief complaint: "What are your symptoms?"
-Timeline: "When did this first start, and has it been getting better, worse, or staying the same?"
-Severity: "Rate your discomfort/pain from 1-10"
-Patient concern: "What concerns you most about this?"
-
-RULES:
-- Maximum 5 total exchanges before handoff
-- Maximum 2 clarifying follow-ups per topic
-- Be energetic, friendly, and helpful
-- Monitor for red flags continuously, and if any are detected, handoff immediately.
-
-RED FLAGS (immediate handoff):
-- Chest pain/pressure/tightness
-- Difficulty breathing
-- Severe pain (8+/10)
-- Sudden severe headache/"worst headache ever"
-- Confusion, slurred speech, one-sided weakness
-- Heavy bleeding
-- Suicidal ideation
-
-If exchange_count >= 5 or all required info gathered or red flag detected, output:
-JSON_HANDOFF:
-{
-  "handoff_status": "EMERGENCY" | "COMPLETE" | "INCOMPLETE",
-  "exchange_count": <number>,
-  "chief_complaint": "<complaint>",
-  "severity": <1-10>,
-  "timeline": {
-    "started": "<when>",
-    "trend": "better" | "worse" | "stable"
-  },
-  "symptom_details": {
-    "location": "<where>",
-    "quality": "<description>",
-    "characteristics": "<details>"
-  },
-  "associated_symptoms": ["<symptom1>", "<symptom2>"],
-  "red_flags": {
-    "present": ["<flag1>"],
-    "ruled_out": ["<flag2>"]
-  },
-  "patient_concern": "<concern>",
-  "relevant_history": "<history>"
-}
-
-Otherwise, ask the next most important question."""
-
+        context = self._history_context(patient_input, exchange_count, red_flags,
+                                       self._history_window(await _token_counter(self.model)))
+        
+        # JSON mode makes every reply a bare JSON object: either a handoff or
+        # {"next_question": ...}
+        json_mode = self.model in _JSON_MODE_MODELS
+        
+        response = await self._stream_history_reply(context, json_mode)
+        if response is None:
+            return None, {
+                "handoff_status": "EMERGENCY",
+                "exchange_count": exchange_count,
+                "chief_complaint": patient_input[:100],
+                "severity": 10,  # Unknown; conservative bias
+                "red_flags": {"present": red_flags, "ruled_out": []}
+            }
+        
+        return self._parse_history_reply(response, patient_input, exchange_count, red_flags, json_mode,
+                                         force_handoff=force_handoff)
+    
+    async def _stream_history_reply(self, context: str, json_mode: bool) -> Optional[str]:
+        """
+        Stream one history agent reply and return its text, or None once an
+        EMERGENCY handoff is seen and generation is cancelled
+        """
+        response = ""
+        scanning = True
+        stream = self.stream_llm(
+            "history", context,
+            response_format={"type": "json_object"} if json_mode else None
+        )
+        try:
+            async for piece in stream:
+                scan_from = max(0, len(response) - 64)
+                response += piece
+                if not scanning:
+                    continue
+                match = _STREAM_STATUS_RE.search(response, scan_from)
+                if match is None:
+                    continue
+                if match.group(1) == "EMERGENCY":
+                    logger.info("Emergency handoff streamed; cancelling remaining generation")
+                    return None
+                scanning = False
+        finally:
+            await stream.aclose()
+        return response
+    
+    def _history_window(self, count_tokens: Callable[[str], int]) -> List[str]:
+        """
+        conversation_history trimmed to HISTORY_TOKEN_BUDGET: the opening
+        complaint is always kept, then as many of the latest entries as fit.
+        Token counts are cached per entry, so only new entries are counted.
+        """
+        history = self.conversation_history
+        if history is not self._counted_history or len(self._history_counts) > len(history):
+            self._counted_history = history
+            self._history_counts = []
+            self._history_tokens = 0
+        counts = self._history_counts
+        for entry in history[len(counts):]:
+            counts.append(count_tokens(entry))
+            self._history_tokens += counts[-1]
+        
+        if self._history_tokens <= self.HISTORY_TOKEN_BUDGET:
+            return history
+        
+        budget = self.HISTORY_TOKEN_BUDGET - counts[0]
+        start = len(history)
+        while start > 1 and counts[start - 1] <= budget:
+            start -= 1
+            budget -= counts[start]
+        logger.info(f"History context trimmed: {start - 1} earlier entries omitted")
+        return [history[0], f"({start - 1} earlier entries omitted)"] + history[start:]
+    
+    @staticmethod
+    def _history_context(patient_input: str, exchange_count: int, red_flags: List[str],
+                         conversation_history: List[str]) -> str:
         # Build conversation context
         context = f"Exchange {exchange_count}:\nPatient: {patient_input}\n"
-        if self.conversation_history:
-            context = "Previous exchanges:\n" + "\n".join(self.conversation_history) + "\n" + context
+        if conversation_history:
+            context = "Previous exchanges:\n" + "\n".join(conversation_history) + "\n" + context
         
         # Add red flag context if detected
         if red_flags:
@@ -175,100 +837,118 @@ Otherwise, ask the next most important question."""
         # Add exchange count warning
         if exchange_count >= 4:
             context += f"\nNOTE: This is exchange {exchange_count} of maximum 5. Prepare for handoff."
+        return context
+    
+    @staticmethod
+    def _parse_history_reply(response: str, patient_input: str, exchange_count: int,
+                             red_flags: List[str], json_mode: bool,
+                             force_handoff: bool = False) -> Tuple[Optional[str], Optional[Dict]]:
+        """Turn a history agent reply into (question, None) or (None, patient_data)"""
+        try:
+            reply = json_loads(response)
+        except json.JSONDecodeError as e:
+            reply = None
+            if not json_mode:
+                # Without JSON mode the object may be wrapped in prose or a
+                # code fence; try the outermost braces before anything else
+                start, end = response.find("{"), response.rfind("}")
+                if start != -1 and end > start:
+                    try:
+                        reply = json_loads(response[start:end + 1])
+                    except json.JSONDecodeError:
+                        reply = None
+                if reply is None and not force_handoff:
+                    # A plain-text reply is the next question
+                    return response.strip(), None
+            if reply is None:
+                logger.error(f"JSON parsing error: {e}")
         
-        response = self.call_llm(system_prompt, context)
+        if isinstance(reply, dict) and "handoff_status" in reply:
+            patient_data = reply
+            
+            # Ensure red flags are included if detected
+            if red_flags and not patient_data.get("red_flags", {}).get("present"):
+                patient_data["red_flags"] = {"present": red_flags, "ruled_out": []}
+                patient_data["handoff_status"] = "EMERGENCY"
+            
+            return None, patient_data
         
-        # Check if JSON handoff is in response
-        if "JSON_HANDOFF:" in response:
-            try:
-                json_start = response.find("{")
-                json_end = response.rfind("}") + 1
-                json_str = response[json_start:json_end]
-                patient_data = json.loads(json_str)
-                
-                # Ensure red flags are included if detected
-                if red_flags and not patient_data.get("red_flags", {}).get("present"):
-                    patient_data["red_flags"] = {"present": red_flags, "ruled_out": []}
-                    patient_data["handoff_status"] = "EMERGENCY"
-                
-                return None, patient_data
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON parsing error: {e}")
-                # Create emergency handoff on parse error
-                return None, {
-                    "handoff_status": "INCOMPLETE",
-                    "exchange_count": exchange_count,
-                    "chief_complaint": patient_input[:100],
-                    "severity": 5,
-                    "patient_concern": "Unable to parse complete history",
-                    "red_flags": {"present": red_flags, "ruled_out": []}
-                }
-        else:
-            # Extract the question from response
-            question = response.strip()
-            return question, None
+        if isinstance(reply, dict) and str(reply.get("next_question") or "").strip() and not force_handoff:
+            return str(reply["next_question"]).strip(), None
+        
+        # Create incomplete handoff on an unparseable reply (or a question
+        # when no further exchange is possible); detected red flags escalate
+        return None, {
+            "handoff_status": "EMERGENCY" if red_flags else "INCOMPLETE",
+            "exchange_count": exchange_count,
+            "chief_complaint": patient_input[:100],
+            "severity": 5,
+            "patient_concern": "Unable to parse complete history",
+            "red_flags": {"present": red_flags, "ruled_out": []}
+        }
     
-    def decision_agent(self, patient_data: Dict) -> str:
+    async def decision_agent(self, patient_data: Dict) -> str:
         """
         Agent 2: Triage & Decision Agent
         Parses JSON, assesses risk, decides treat vs. escalate
         """
         
-        system_prompt = """You are a medical triage and decision assistant. Parse the patient data and make treatment decisions.
-
-DECISION LOGIC:
-1. IF handoff_status == "EMERGENCY" → Generate escalation (Call 911/ER/urgent care)
-2. IF handoff_status == "INCOMPLETE" OR uncertain diagnosis → Conservative escalation (see doctor within X hours/days)
-3. IF mild symptoms, no red flags → Generate 3-step treatment plan
-
-TREATMENT OUTPUT FORMAT:
-1. [First self-care recommendation]
-2. [Second self-care recommendation]
-3. [Third self-care recommendation]
-
-"If this isn't improving in [X] days, please contact your doctor."
-"I can provide guidance, but I cannot replace an in-person examination."
-"How does this sound to you?"
-
-ESCALATION OUTPUT FORMAT:
-"Based on what you've told me, [assessment]. This is beyond what I can safely assess remotely. Here's what I recommend: [specific action with timeframe]."
-
-Conservative bias: When uncertain, default to escalation."""
-
-        user_message = f"Patient data:\n{json.dumps(patient_data, indent=2)}\n\nProvide appropriate response based on the decision logic."
+        # Without a response cache, exact repeats of a patient profile are
+        # answered from the in-process memo
+        use_memo = self.decision_memo and self.cache is None
+        memo_key = (self.model, json_dumps(patient_data, sort_keys=True))
+        if use_memo:
+            memoized = self._decision_memo.get(memo_key)
+            if memoized is not None:
+                response, stored_at = memoized
+                if time.monotonic() - stored_at <= self.decision_memo_ttl_seconds:
+                    self._decision_memo.move_to_end(memo_key)
+                    logger.info("Decision memo hit")
+                    return response
+                del self._decision_memo[memo_key]
         
-        response = self.call_llm(system_prompt, user_message, temperature=0.3)
+        user_message = _decision_message(patient_data)
+        
+        # Every other field the prompt reads must match exactly; only the
+        # complaint wording is compared semantically
+        profile = {key: value for key, value in patient_data.items() if key != "chief_complaint"}
+        partition = ("decision", self.model, json_dumps(profile, sort_keys=True))
+        complaint = str(patient_data.get("chief_complaint", "")).strip().lower()
+        response = await self.call_llm("decision", user_message, temperature=0.3,
+                                       cache_key=(partition, complaint))
+        
+        if use_memo:
+            self._decision_memo[memo_key] = (response, time.monotonic())
+            self._decision_memo.move_to_end(memo_key)
+            if len(self._decision_memo) > self.DECISION_MEMO_SIZE:
+                self._decision_memo.popitem(last=False)
         return response
     
-    def communication_agent(self, decision_output: str) -> str:
+    async def communication_agent(self, decision_output: str) -> str:
         """
         Agent 3: Communication Agent
         Applies linguistic and empathy requirements to Agent 2's output
         """
         
-        system_prompt = """You are a medical communication specialist. Transform the medical response to be more empathetic and clear.
-
-REQUIRED TRANSFORMATIONS:
-You do not have to include all of these in your response, only transform if conditions are met.
-- "I see" / "I hear" → "I understand"
-- Medical jargon → lay terms (e.g., "hypertension" → "high blood pressure")
-- When worry expressed → "It's completely understandable that you're concerned about [specific symptom]"
-- When pain described → "That sounds really uncomfortable"
-- Never say "don't worry" → use "let's work through this together"
-
-MAINTAIN:
-- All clinical content and safety language
-- The structure and recommendations
-- Required phrases: "I can provide guidance, but I cannot replace an in-person examination" and "How does this sound to you?"
-
-Only modify communication style and word choice, not medical content."""
-
-        user_message = f"Transform this medical response:\n{decision_output}"
+        user_message = _communication_message(decision_output)
+        max_tokens = self._communication_max_tokens(decision_output,
+                                                    await _token_counter(self.COMMUNICATION_MODEL))
         
-        response = self.call_llm(system_prompt, user_message, temperature=0.5)
+        # Exact matches only: near-identical plans can differ in safety-relevant
+        # details (timeframes, escalation wording) that must survive the rewrite
+        response = await self.call_llm("communication", user_message, temperature=0.5,
+                                       cache_key=(("communication",), decision_output), semantic=False,
+                                       max_tokens=max_tokens,
+                                       model=self.COMMUNICATION_MODEL,
+                                       truncated_fallback=decision_output)
         return response
     
-    def process_consultation(self, initial_complaint: str) -> str:
+    def _communication_max_tokens(self, decision_output: str, count_tokens: Callable[[str], int]) -> int:
+        """Rewrite budget: COMMUNICATION_MAX_TOKENS, raised for unusually long decisions"""
+        decision_tokens = count_tokens(decision_output)
+        return min(self.MAX_TOKENS, max(self.COMMUNICATION_MAX_TOKENS, decision_tokens + 100))
+    
+    async def process_consultation(self, initial_complaint: str) -> str:
         """
         Main orchestration method for the entire consultation process
         """
@@ -285,7 +965,7 @@ Only modify communication style and word choice, not medical content."""
             self.conversation_history.append(f"Patient: {current_input}")
             
             # Process through history agent
-            question, patient_data = self.history_agent(current_input, exchange_count)
+            question, patient_data = await self.history_agent(current_input, exchange_count)
             
             if patient_data:
                 # Handoff triggered
@@ -298,65 +978,290 @@ Only modify communication style and word choice, not medical content."""
                 print(f"\nAssistant: {question}")
                 
                 # Get next patient input (in production, this would come from user)
-                current_input = input("Patient: ")
+                current_input = await _ainput("Patient: ")
                 exchange_count += 1
             
             # Force handoff at exchange 5
             if exchange_count > 5 and not patient_data:
                 logger.warning("Forcing handoff at exchange limit")
-                patient_data = {
-                    "handoff_status": "INCOMPLETE",
-                    "exchange_count": 5,
-                    "chief_complaint": initial_complaint,
-                    "severity": 5,
-                    "timeline": {"started": "unknown", "trend": "stable"},
-                    "symptom_details": {},
-                    "associated_symptoms": [],
-                    "red_flags": {"present": [], "ruled_out": []},
-                    "patient_concern": "Unable to complete assessment",
-                    "relevant_history": ""
-                }
+                patient_data = _forced_handoff(initial_complaint)
                 self.patient_data = patient_data
                 break
         
         # Phase 2: Decision Making
         logger.info("Decision Agent processing")
-        decision_output = self.decision_agent(self.patient_data)
+        decision_output = await self.decision_agent(self.patient_data)
         logger.info(f"Decision: {decision_output[:100]}...")
         
         # Phase 3: Communication Enhancement
         logger.info("Communication Agent processing")
-        final_response = self.communication_agent(decision_output)
+        final_response = await self.communication_agent(decision_output)
         
         # Log the complete consultation
         self.log_consultation(final_response)
         
         return final_response
     
-    def log_consultation(self, final_response: str):
-        """Log the consultation for audit purposes"""
+    async def process_consultations_concurrent(self, complaints: List[str]) -> List[Optional[str]]:
+        """
+        Real-time triage for a queue of single-message complaints: each runs
+        through all three agents in its own system (sharing this one's client,
+        rate limits and cache) and the consultations proceed concurrently.
+        Returns one final response per complaint, or None where it failed.
+        """
+        async def triage(complaint: str) -> str:
+            system = MedicalConsultationSystem("", self.model, cache=self.cache, client=self._api,
+                                               decision_memo=self.decision_memo,
+                                               decision_memo_ttl_seconds=self.decision_memo_ttl_seconds)
+            try:
+                system.conversation_history = [f"Patient: {complaint}"]
+                # No follow-up questions are possible, so this is the final exchange
+                _, system.patient_data = await system.history_agent(complaint, exchange_count=5,
+                                                                    force_handoff=True)
+                final_response = await system.communication_agent(await system.decision_agent(system.patient_data))
+                system.log_consultation(final_response)
+                return final_response
+            finally:
+                await system.aclose()
+        
+        results = await asyncio.gather(*(triage(c) for c in complaints), return_exceptions=True)
+        final_responses: List[Optional[str]] = []
+        for complaint, result in zip(complaints, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Consultation error for '{complaint[:50]}': {result}")
+                result = None
+            final_responses.append(result)
+        return final_responses
+    
+    async def process_consultations_batch(self, complaints: List[str],
+                                          poll_interval: float = 30.0) -> List[Optional[str]]:
+        """
+        Offline triage: run many single-message complaints through all three
+        agents with the OpenAI Batch API (one batch job per agent stage, at
+        roughly half the per-request cost). The history stage is asked for an
+        immediate handoff since no follow-up questions are possible.
+        Returns one final response per complaint, or None where a request failed.
+        """
+        json_mode = self.model in _JSON_MODE_MODELS
+        red_flags = self.check_for_red_flags_batch(complaints)
+        
+        # Stage 1: history handoff (treated as the final exchange)
+        history_replies = await self._run_batch([
+            self._completion_params(
+                "history", self._history_context(c, 5, flags, []), 0.7,
+                {"type": "json_object"} if json_mode else None
+            )
+            for c, flags in zip(complaints, red_flags)
+        ], poll_interval)
+        patient_records = [
+            self._parse_history_reply(reply or "", c, 5, flags, json_mode, force_handoff=True)[1]
+            for c, flags, reply in zip(complaints, red_flags, history_replies)
+        ]
+        
+        # Stage 2: decisions
+        decisions = await self._run_batch(
+            [self._completion_params("decision", _decision_message(pd), 0.3) for pd in patient_records],
+            poll_interval
+        )
+        
+        # Stage 3: communication, only for decisions that came back
+        pending = [i for i, d in enumerate(decisions) if d is not None]
+        count_tokens = await _token_counter(self.COMMUNICATION_MODEL)
+        rewrites = await self._run_batch(
+            [self._completion_params("communication", _communication_message(decisions[i]), 0.5,
+                                     max_tokens=self._communication_max_tokens(decisions[i], count_tokens),
+                                     model=self.COMMUNICATION_MODEL)
+             for i in pending],
+            poll_interval,
+            truncated_fallbacks=[decisions[i] for i in pending]
+        )
+        
+        final_responses: List[Optional[str]] = [None] * len(complaints)
+        for i, response in zip(pending, rewrites):
+            final_responses[i] = response
+            if response is not None:
+                self.log_consultation(response, patient_records[i], [f"Patient: {complaints[i]}"])
+        return final_responses
+    
+    async def _run_batch(self, request_bodies: List[Dict[str, Any]], poll_interval: float,
+                         truncated_fallbacks: Optional[List[str]] = None) -> List[Optional[str]]:
+        """
+        Submit chat completion bodies as one Batch API job and return contents in
+        order; replies cut off at max_tokens are replaced by truncated_fallbacks[i]
+        """
+        if not request_bodies:
+            return []
+        
+        lines = [
+            json_dumps({"custom_id": f"request-{i}", "method": "POST",
+                         "url": "/v1/chat/completions", "body": body})
+            for i, body in enumerate(request_bodies)
+        ]
+        batch_file = await self.client.files.create(
+            file=("consultations.jsonl", "\n".join(lines).encode()), purpose="batch"
+        )
+        batch = await self.client.batches.create(
+            input_file_id=batch_file.id, endpoint="/v1/chat/completions", completion_window="24h"
+        )
+        logger.info(f"Batch {batch.id} submitted with {len(request_bodies)} requests")
+        
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            await asyncio.sleep(poll_interval)
+            try:
+                batch = await self.client.batches.retrieve(batch.id)
+            except self._api.retry_policy.retryable as e:
+                # A job can run for hours; one failed status check must not abandon it
+                logger.warning(f"Batch {batch.id} status check failed, retrying next poll: {e}")
+        if batch.status != "completed":
+            raise RuntimeError(f"Batch {batch.id} ended with status '{batch.status}'")
+        
+        results: List[Optional[str]] = [None] * len(request_bodies)
+        if batch.output_file_id:
+            output = await self.client.files.content(batch.output_file_id)
+            for line in output.text.splitlines():
+                if not line.strip():
+                    continue
+                record = json_loads(line)
+                index = int(record["custom_id"].rsplit("-", 1)[1])
+                choices = ((record.get("response") or {}).get("body") or {}).get("choices") or []
+                if not choices:
+                    continue
+                if choices[0].get("finish_reason") == "length" and truncated_fallbacks is not None:
+                    logger.warning(f"Batch {batch.id}: {record['custom_id']} truncated; using fallback")
+                    results[index] = truncated_fallbacks[index]
+                else:
+                    results[index] = choices[0]["message"]["content"]
+        
+        failed = results.count(None)
+        if failed:
+            logger.error(f"Batch {batch.id}: {failed} of {len(request_bodies)} requests failed")
+        return results
+    
+    def log_consultation(self, final_response: str, patient_data: Optional[Dict] = None,
+                         conversation_history: Optional[List[str]] = None):
+        """
+        Log the consultation for audit purposes (the file write runs in the background).
+        Defaults to the current consultation's patient data and history.
+        """
         log_entry = {
             "timestamp": datetime.now().isoformat(),
-            "patient_data": self.patient_data,
-            "conversation_history": self.conversation_history,
+            "patient_data": self.patient_data if patient_data is None else patient_data,
+            "conversation_history": list(self.conversation_history if conversation_history is None
+                                         else conversation_history),
             "final_response": final_response
         }
         
         # In production, save to database or file
         logger.info(f"Consultation logged: {log_entry['timestamp']}")
         
-        # Save to file
-        with open("consultation_log.json", "a") as f:
-            f.write(json.dumps(log_entry) + "\n")
+        # Queued for the background writer so the response is returned without
+        # waiting on disk; aclose() waits for anything still queued
+        _AUDIT_LOG.put(log_entry)
 
 
-def main():
+async def _ainput(prompt: str = "") -> str:
+    """
+    input() on a daemon thread, so the event loop keeps serving other
+    consultations while waiting and a pending read never blocks shutdown
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    
+    def deliver(setter, value):
+        if not future.done():
+            setter(value)
+    
+    def read():
+        try:
+            line = input(prompt)
+        except Exception as e:
+            loop.call_soon_threadsafe(deliver, future.set_exception, e)
+        else:
+            loop.call_soon_threadsafe(deliver, future.set_result, line)
+    
+    threading.Thread(target=read, name="patient-input", daemon=True).start()
+    return await future
+
+
+def _forced_handoff(initial_complaint: str) -> Dict:
+    """INCOMPLETE handoff used when the exchange limit is reached without one"""
+    return {
+        "handoff_status": "INCOMPLETE",
+        "exchange_count": 5,
+        "chief_complaint": initial_complaint,
+        "severity": 5,
+        "timeline": {"started": "unknown", "trend": "stable"},
+        "symptom_details": {},
+        "associated_symptoms": [],
+        "red_flags": {"present": [], "ruled_out": []},
+        "patient_concern": "Unable to complete assessment",
+        "relevant_history": ""
+    }
+
+
+class _AuditLogWriter:
+    """
+    Append-only audit log fed through a queue: a daemon thread drains up to
+    BATCH_SIZE entries at a time and writes each batch with a single write()
+    """
+    
+    BATCH_SIZE = 64
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+    
+    def put(self, log_entry: Dict):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="consultation-log-writer", daemon=True)
+                    self._thread.start()
+        self._queue.put_nowait(log_entry)
+    
+    def flush(self):
+        """Block until every queued entry has been written"""
+        if self._thread is not None:
+            self._queue.join()
+    
+    def _run(self):
+        f = None
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if f is None:
+                    f = open(self.path, "a", encoding="utf-8")
+                f.write("".join(json_dumps(entry) + "\n" for entry in batch))
+                f.flush()
+            except Exception as e:
+                logger.error(f"Failed to write consultation log: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+_AUDIT_LOG = _AuditLogWriter("consultation_log.json")
+atexit.register(_AUDIT_LOG.flush)
+
+
+async def main():
     """Main execution function with example usage"""
     
     # Initialize system (replace with your actual API key)
     API_KEY = "your-openai-api-key-here"
-    system = MedicalConsultationSystem(API_KEY)
-    
+    async with MedicalConsultationSystem(API_KEY) as system:
+        await _run_example(system)
+
+
+async def _run_example(system: MedicalConsultationSystem):
+    """Interactive example loop over a single shared system"""
     print("=" * 50)
     print("AI Primary Care Consultation System")
     print("=" * 50)
@@ -364,7 +1269,7 @@ def main():
     print("(Type 'quit' to exit)\n")
     
     while True:
-        initial_complaint = input("Patient: ")
+        initial_complaint = await _ainput("Patient: ")
         
         if initial_complaint.lower() == 'quit':
             print("Thank you for using the consultation system. Goodbye!")
@@ -372,7 +1277,7 @@ def main():
         
         try:
             # Process the consultation
-            final_response = system.process_consultation(initial_complaint)
+            final_response = await system.process_consultation(initial_complaint)
             
             print("\n" + "=" * 50)
             print("FINAL RESPONSE:")
@@ -386,11 +1291,11 @@ def main():
             print("Please try again or contact support if the issue persists.\n")
         
         print("\nWould you like to start a new consultation? (yes/no)")
-        if input().lower() != 'yes':
+        if (await _ainput()).lower() != 'yes':
             break
     
     print("\nThank you for using the AI Primary Care Consultation System.")
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())